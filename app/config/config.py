@@ -61,6 +61,7 @@ class Settings(BaseSettings):
     MAX_RETRIES: int = MAX_RETRIES
     PROXIES: List[str] = []
     PROXIES_USE_CONSISTENCY_HASH_BY_API_KEY: bool = True  # 是否使用一致性哈希来选择代理
+    HTTP2_ENABLED: bool = False  # 是否对上游使用HTTP/2（单连接最多100个并发流，超出的请求会排队）
     VERTEX_API_KEYS: List[str] = []
     VERTEX_EXPRESS_BASE_URL: str = "https://aiplatform.googleapis.com/v1beta1/publishers/google"
 
@@ -6,50 +6,126 @@
 import re
 import json
 import os
-from typing import Dict, Any, Optional
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Dict, Any, NamedTuple, Optional, Union
 from app.config.config import settings
 from app.log.logger import get_gemini_logger
+from app.utils.helpers import json_dumps, json_loads
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
 
 logger = get_gemini_logger()
 
+# 预编译的正则表达式，避免每次调用时重复解析
+_URL_RE = re.compile(r'https?://[^\s]+')
+_UPPER_TOKEN_RE = re.compile(r'\b[A-Z_]{2,}\b')
+_PAREN_RE = re.compile(r'\([^)]*\)')
+_WS_RE = re.compile(r'\s+')
+_STATUS_CODE_RE = re.compile(r"status code (\d+)")
+_JSON_OBJECT_RE = re.compile(r'\s*\{')
+_JSON_OBJECT_BYTES_RE = re.compile(rb'\s*\{')
+
+# 错误响应缓存：上游返回的错误内容高度重复（429、401等），超过此长度的内容不进入缓存
+_RESPONSE_CACHE_SIZE = 1024
+_RESPONSE_CACHE_MAX_CONTENT_LENGTH = 4096
+_SSE_CACHE_SIZE = 256
+
+# 技术消息清理结果缓存，超过此长度的消息不进入缓存
+_CLEAN_CACHE_SIZE = 512
+_CLEAN_CACHE_MAX_MESSAGE_LENGTH = 2048
+
+# 自定义错误映射环境变量前缀
+_ENV_MAPPING_PREFIX = 'CUSTOM_ERROR_MAPPING_'
+
+
+# 默认错误消息映射（只读）
+_DEFAULT_ERROR_MESSAGES = MappingProxyType({
+    # HTTP状态码映射
+    400: "请求参数错误，请检查您的输入",
+    401: "API密钥无效或已过期，请联系管理员",
+    403: "访问被拒绝，权限不足",
+    404: "请求的资源不存在",
+    408: "请求超时，请稍后重试",
+    429: "请求过于频繁，请稍后重试", 
+    500: "远程服务出现问题，请稍后重试",
+    502: "网关错误，服务暂时不可用",
+    503: "服务暂时不可用，请稍后重试",
+    504: "网关超时，请稍后重试"
+})
+
+# 错误关键词映射（只读）
+_ERROR_KEYWORD_MESSAGES = MappingProxyType({
+    "INTERNAL": "远程服务内部错误",
+    "QUOTA_EXCEEDED": "API配额已超限",
+    "PERMISSION_DENIED": "权限被拒绝",
+    "INVALID_ARGUMENT": "请求参数无效",
+    "DEADLINE_EXCEEDED": "请求超时",
+    "RESOURCE_EXHAUSTED": "资源已耗尽",
+    "UNAUTHENTICATED": "身份验证失败",
+    "UNAVAILABLE": "服务暂时不可用",
+    "NOT_FOUND": "请求的资源不存在",
+    "ALREADY_EXISTS": "资源已存在",
+    "CANCELLED": "请求被取消",
+    "DATA_LOSS": "数据丢失",
+    "UNKNOWN": "未知错误"
+})
+
+
+class ErrorInfo(NamedTuple):
+    """从原始错误内容中提取出的错误信息"""
+    status_code: Optional[int]
+    original_message: str
+    error_type: str
+    details: Any
+
+
+def _clean_technical_text(message: str) -> str:
+    """清理技术性消息内容的具体实现，见 UserFriendlyErrorHandler._clean_technical_message"""
+    # 移除URL和技术链接
+    message = _URL_RE.sub('', message)
+    
+    # 移除技术性的错误代码格式
+    message = _UPPER_TOKEN_RE.sub('', message)
+    
+    # 移除括号中的技术内容
+    message = _PAREN_RE.sub('', message)
+    
+    # 清理多余的空格
+    message = _WS_RE.sub(' ', message).strip()
+    
+    # 如果消息太短或为空，返回空字符串
+    if len(message) < 10:
+        return ""
+        
+    return message
+
+
+_cached_clean_technical_text = lru_cache(maxsize=_CLEAN_CACHE_SIZE)(_clean_technical_text)
+
 
 class UserFriendlyErrorHandler:
     """用户友好错误处理器"""
     
-    # 默认错误消息映射
-    DEFAULT_ERROR_MESSAGES = {
-        # HTTP状态码映射
-        400: "请求参数错误，请检查您的输入",
-        401: "API密钥无效或已过期，请联系管理员",
-        403: "访问被拒绝，权限不足",
-        404: "请求的资源不存在",
-        408: "请求超时，请稍后重试",
-        429: "请求过于频繁，请稍后重试", 
-        500: "远程服务出现问题，请稍后重试",
-        502: "网关错误，服务暂时不可用",
-        503: "服务暂时不可用，请稍后重试",
-        504: "网关超时，请稍后重试"
-    }
+    # 默认错误消息映射（保留类属性以兼容外部引用）
+    DEFAULT_ERROR_MESSAGES = _DEFAULT_ERROR_MESSAGES
     
     # 错误关键词映射
-    ERROR_KEYWORD_MESSAGES = {
-        "INTERNAL": "远程服务内部错误",
-        "QUOTA_EXCEEDED": "API配额已超限",
-        "PERMISSION_DENIED": "权限被拒绝",
-        "INVALID_ARGUMENT": "请求参数无效",
-        "DEADLINE_EXCEEDED": "请求超时",
-        "RESOURCE_EXHAUSTED": "资源已耗尽",
-        "UNAUTHENTICATED": "身份验证失败",
-        "UNAVAILABLE": "服务暂时不可用",
-        "NOT_FOUND": "请求的资源不存在",
-        "ALREADY_EXISTS": "资源已存在",
-        "CANCELLED": "请求被取消",
-        "DATA_LOSS": "数据丢失",
-        "UNKNOWN": "未知错误"
-    }
+    ERROR_KEYWORD_MESSAGES = _ERROR_KEYWORD_MESSAGES
+
+    # 关键词元组，避免每次匹配时迭代映射
+    _ERROR_KEYWORDS = tuple(_ERROR_KEYWORD_MESSAGES)
 
     def __init__(self):
         self._custom_mappings = None
+        self._automaton = None
+        self._catch_all_mapping = None
+        self._ordered_keys = []
+        self._cached_response = lru_cache(maxsize=_RESPONSE_CACHE_SIZE)(self._build_cached_response)
+        self._cached_sse_error = lru_cache(maxsize=_SSE_CACHE_SIZE)(self._build_sse_error)
         self._load_custom_mappings()
 
     def _load_custom_mappings(self) -> None:
@@ -66,16 +142,16 @@ class UserFriendlyErrorHandler:
         
         # 2. 从环境变量中加载（格式：CUSTOM_ERROR_MAPPING_1=key1:value1）
         env_mappings = {}
-        for env_key, env_value in os.environ.items():
-            if env_key.startswith('CUSTOM_ERROR_MAPPING_'):
-                try:
-                    if ':' in env_value:
-                        key, value = env_value.split(':', 1)  # 只分割第一个冒号
-                        env_mappings[key.strip()] = value.strip()
-                    else:
-                        logger.warning(f"Invalid format for environment variable {env_key}: {env_value}")
-                except Exception as e:
-                    logger.error(f"Error parsing environment variable {env_key}: {e}")
+        environ = os.environ
+        for env_key in environ:
+            if not env_key.startswith(_ENV_MAPPING_PREFIX):
+                continue
+            env_value = environ[env_key]
+            separator = env_value.find(':')  # 只按第一个冒号分割
+            if separator < 0:
+                logger.warning(f"Invalid format for environment variable {env_key}: {env_value}")
+                continue
+            env_mappings[env_value[:separator].strip()] = env_value[separator + 1:].strip()
         
         if env_mappings:
             self._custom_mappings.update(env_mappings)
@@ -85,7 +161,7 @@ class UserFriendlyErrorHandler:
         json_mappings_env = os.environ.get('CUSTOM_ERROR_MAPPINGS_JSON')
         if json_mappings_env:
             try:
-                json_mappings = json.loads(json_mappings_env)
+                json_mappings = json_loads(json_mappings_env)
                 if isinstance(json_mappings, dict):
                     self._custom_mappings.update(json_mappings)
                     logger.info(f"Loaded {len(json_mappings)} custom error mappings from JSON environment variable")
@@ -96,6 +172,40 @@ class UserFriendlyErrorHandler:
         
         logger.info(f"Total custom error mappings loaded: {len(self._custom_mappings)}")
 
+        # 按匹配规则预先排序：先按长度降序，再按字典序升序，线性扫描时第一个命中即为最佳匹配
+        self._ordered_keys = sorted(
+            ((key.lower(), key, value) for key, value in self._custom_mappings.items()),
+            key=lambda item: (-len(item[1]), item[1])
+        )
+        self._build_automaton()
+
+    def _build_automaton(self) -> None:
+        """
+        为自定义映射构建Aho-Corasick自动机，一次扫描即可找出所有匹配的key
+        未安装pyahocorasick或没有非空key时保持为None，匹配时回退到线性扫描；
+        空key可匹配任意消息，不放入自动机，作为没有其他匹配时的兜底
+        """
+        self._automaton = None
+        self._catch_all_mapping = self._custom_mappings.get("")
+        if ahocorasick is None or not self._custom_mappings:
+            return
+
+        automaton = ahocorasick.Automaton()
+        has_words = False
+        for key, value in self._custom_mappings.items():
+            key_lower = key.lower()
+            if not key_lower:
+                continue
+            # 小写后相同的key只保留字典序最小的一个，与排序规则保持一致
+            existing = automaton.get(key_lower, None)
+            if existing is None or key < existing[1]:
+                automaton.add_word(key_lower, (len(key), key, value))
+                has_words = True
+        if not has_words:
+            return
+        automaton.make_automaton()
+        self._automaton = automaton
+
     def _find_best_custom_match(self, message: str) -> Optional[str]:
         """
         在错误消息中查找最佳的自定义匹配
@@ -112,100 +222,112 @@ class UserFriendlyErrorHandler:
         """
         if not self._custom_mappings:
             return None
+
+        if self._automaton is not None:
+            best_match = None
+            for _, (key_len, key, value) in self._automaton.iter(message.lower()):
+                if best_match is None or (-key_len, key) < (-best_match[0], best_match[1]):
+                    best_match = (key_len, key, value)
+            if best_match is None:
+                return self._catch_all_mapping
+            logger.debug("Found custom error mapping match: '%s' -> '%s'", best_match[1], best_match[2])
+            return best_match[2]
         
-        matches = []
         message_lower = message.lower()
-        
-        # 查找所有匹配的键
-        for key, value in self._custom_mappings.items():
-            if key.lower() in message_lower:
-                matches.append((key, value))
-        
-        if not matches:
-            return None
-        
-        # 按匹配规则排序：先按长度降序，再按字典序升序
-        matches.sort(key=lambda x: (-len(x[0]), x[0]))
-        
-        best_match = matches[0]
-        logger.debug(f"Found custom error mapping match: '{best_match[0]}' -> '{best_match[1]}'")
-        
-        return best_match[1]
+        for key_lower, key, value in self._ordered_keys:
+            if key_lower in message_lower:
+                logger.debug("Found custom error mapping match: '%s' -> '%s'", key, value)
+                return value
+
+        return None
+
+    @staticmethod
+    def _looks_like_json_object(content: Union[bytes, str]) -> bool:
+        """检查第一个非空白字符是否为'{'，避免对整个内容调用strip()产生拷贝"""
+        pattern = _JSON_OBJECT_BYTES_RE if isinstance(content, bytes) else _JSON_OBJECT_RE
+        return pattern.match(content) is not None
+
+    @staticmethod
+    def _to_text(content: Union[bytes, str]) -> str:
+        """将原始错误内容转换为字符串，只在需要展示时才解码字节"""
+        if isinstance(content, bytes):
+            return content.decode("utf-8", errors="replace")
+        return content
 
     @classmethod
-    def extract_error_info(cls, error_content: str) -> Dict[str, Any]:
+    def extract_error_info(cls, error_content: Union[bytes, str]) -> ErrorInfo:
         """
         从错误内容中提取错误信息
+        JSON格式的字节内容直接解析，无需先解码为字符串
         
         Args:
-            error_content: 原始错误内容
+            error_content: 原始错误内容（字符串或字节）
             
         Returns:
-            包含错误信息的字典
+            错误信息
         """
-        error_info = {
-            "status_code": None,
-            "original_message": "",
-            "error_type": "UNKNOWN",
-            "details": None
-        }
+        status_code = None
+        original_message = ""
+        error_type = "UNKNOWN"
+        details = None
         
         try:
             # 尝试解析JSON格式的错误
-            if error_content.strip().startswith('{'):
-                error_data = json.loads(error_content)
+            if cls._looks_like_json_object(error_content):
+                error_data = json_loads(error_content)
                 
                 # 处理Google API标准错误格式
                 if "error" in error_data:
                     error_obj = error_data["error"]
-                    error_info["status_code"] = error_obj.get("code")
-                    error_info["original_message"] = error_obj.get("message", "")
-                    error_info["error_type"] = error_obj.get("status", "UNKNOWN")
-                    error_info["details"] = error_obj.get("details")
+                    status_code = error_obj.get("code")
+                    original_message = error_obj.get("message", "")
+                    error_type = error_obj.get("status", "UNKNOWN")
+                    details = error_obj.get("details")
                 
                 # 处理OpenAI API错误格式
                 elif "message" in error_data:
-                    error_info["original_message"] = error_data.get("message", "")
-                    error_info["error_type"] = error_data.get("type", "UNKNOWN")
+                    original_message = error_data.get("message", "")
+                    error_type = error_data.get("type", "UNKNOWN")
                     
             else:
                 # 处理非JSON格式的错误
-                error_info["original_message"] = error_content
+                original_message = cls._to_text(error_content)
                 
                 # 尝试从错误消息中提取状态码
-                status_match = re.search(r"status code (\d+)", error_content)
+                status_match = _STATUS_CODE_RE.search(original_message)
                 if status_match:
-                    error_info["status_code"] = int(status_match.group(1))
+                    status_code = int(status_match.group(1))
                 
                 # 尝试识别错误类型
-                for keyword, error_type in cls.ERROR_KEYWORD_MESSAGES.items():
-                    if keyword in error_content.upper():
-                        error_info["error_type"] = keyword
+                upper_content = original_message.upper()
+                for keyword in cls._ERROR_KEYWORDS:
+                    if keyword in upper_content:
+                        error_type = keyword
                         break
                         
         except json.JSONDecodeError:
             # JSON解析失败，使用原始错误内容
-            error_info["original_message"] = error_content
-            logger.warning(f"Failed to parse error content as JSON: {error_content}")
+            original_message = cls._to_text(error_content)
+            logger.warning(f"Failed to parse error content as JSON: {original_message}")
         except Exception as e:
             logger.error(f"Error parsing error content: {e}")
-            error_info["original_message"] = error_content
+            original_message = cls._to_text(error_content)
             
-        return error_info
+        return ErrorInfo(status_code, original_message, error_type, details)
 
-    def create_user_friendly_message(self, error_info: Dict[str, Any]) -> str:
+    def create_user_friendly_message(self, error_info: ErrorInfo) -> str:
         """
         创建用户友好的错误消息
         
         Args:
-            error_info: 错误信息字典
+            error_info: 错误信息
             
         Returns:
             用户友好的错误消息
         """
-        status_code = error_info.get("status_code")
-        error_type = error_info.get("error_type", "UNKNOWN")
-        original_message = error_info.get("original_message", "")
+        status_code = error_info.status_code
+        error_type = error_info.error_type
+        original_message = error_info.original_message
         
         # 1. 首先检查自定义错误映射
         custom_message = self._find_best_custom_match(original_message)
@@ -213,13 +335,10 @@ class UserFriendlyErrorHandler:
             return custom_message
         
         # 2. 然后尝试根据状态码获取消息
-        if status_code and status_code in self.DEFAULT_ERROR_MESSAGES:
-            base_message = self.DEFAULT_ERROR_MESSAGES[status_code]
+        base_message = _DEFAULT_ERROR_MESSAGES.get(status_code) if status_code else None
         # 3. 最后尝试根据错误类型获取消息
-        elif error_type in self.ERROR_KEYWORD_MESSAGES:
-            base_message = self.ERROR_KEYWORD_MESSAGES[error_type]
-        else:
-            base_message = "调用远程服务出现问题"
+        if base_message is None:
+            base_message = _ERROR_KEYWORD_MESSAGES.get(error_type, "调用远程服务出现问题")
         
         # 构建完整的用户友好消息
         if original_message:
@@ -238,6 +357,7 @@ class UserFriendlyErrorHandler:
     def _clean_technical_message(cls, message: str) -> str:
         """
         清理技术性消息内容，保留用户可理解的部分
+        上游错误消息高度重复，较短的消息会命中缓存
         
         Args:
             message: 原始技术消息
@@ -245,32 +365,18 @@ class UserFriendlyErrorHandler:
         Returns:
             清理后的消息
         """
-        # 移除URL和技术链接
-        message = re.sub(r'https?://[^\s]+', '', message)
-        
-        # 移除技术性的错误代码格式
-        message = re.sub(r'\b[A-Z_]{2,}\b', '', message)
-        
-        # 移除括号中的技术内容
-        message = re.sub(r'\([^)]*\)', '', message)
-        
-        # 清理多余的空格
-        message = re.sub(r'\s+', ' ', message).strip()
-        
-        # 如果消息太短或为空，返回空字符串
-        if len(message) < 10:
-            return ""
-            
-        return message
+        if len(message) > _CLEAN_CACHE_MAX_MESSAGE_LENGTH:
+            return _clean_technical_text(message)
+        return _cached_clean_technical_text(message)
 
-    def handle_api_error(self, error_content: str, include_original: bool = False) -> Dict[str, Any]:
+    def _build_response(self, error_content: Union[bytes, str], include_original: bool) -> Dict[str, Any]:
         """
-        处理API错误，返回用户友好的错误响应
-        
+        根据原始错误内容构建标准化的错误响应
+
         Args:
             error_content: 原始错误内容
-            include_original: 是否包含原始错误信息（用于调试）
-            
+            include_original: 是否包含原始错误信息
+
         Returns:
             标准化的错误响应
         """
@@ -279,22 +385,78 @@ class UserFriendlyErrorHandler:
         
         response = {
             "error": {
-                "code": error_info.get("status_code", 500),
+                "code": error_info.status_code,
                 "message": user_message,
                 "status": "FAILED"
             }
         }
         
-        # 如果启用调试模式或明确要求，包含原始错误信息
-        if include_original or getattr(settings, 'DEBUG_MODE', False):
+        if include_original:
             response["error"]["original_error"] = {
-                "message": error_info.get("original_message"),
-                "type": error_info.get("error_type"),
-                "details": error_info.get("details")
+                "message": error_info.original_message,
+                "type": error_info.error_type,
+                "details": error_info.details
             }
             
         return response
 
+    def _build_cached_response(self, error_content: Union[bytes, str], include_original: bool) -> Union[MappingProxyType, str]:
+        """
+        构建供LRU缓存共享的只读错误响应
+
+        常见的非调试路径只包含一层扁平字段，直接以只读映射缓存；
+        调试路径中的details为任意嵌套结构，以JSON字符串形式缓存，取出时重新解析
+        """
+        response = self._build_response(error_content, include_original)
+        if include_original:
+            return json_dumps(response)
+        return MappingProxyType({"error": MappingProxyType(response["error"])})
+
+    def handle_api_error(self, error_content: Union[bytes, str], include_original: bool = False) -> Dict[str, Any]:
+        """
+        处理API错误，返回用户友好的错误响应
+        相同的错误内容会命中缓存，每次返回一个新的字典，调用方可以自由修改
+        
+        Args:
+            error_content: 原始错误内容（字符串或字节）
+            include_original: 是否包含原始错误信息（用于调试）
+            
+        Returns:
+            标准化的错误响应
+        """
+        # 如果启用调试模式或明确要求，包含原始错误信息
+        include_original = bool(include_original or getattr(settings, 'DEBUG_MODE', False))
+
+        if not isinstance(error_content, (bytes, str)) or len(error_content) > _RESPONSE_CACHE_MAX_CONTENT_LENGTH:
+            return self._build_response(error_content, include_original)
+        cached = self._cached_response(error_content, include_original)
+        if isinstance(cached, str):
+            return json_loads(cached)
+        # 共享的缓存响应是只读的，这里只需浅拷贝一层即可交给调用方
+        return {"error": dict(cached["error"])}
+
+    def _build_sse_error(self, error_content: Union[bytes, str], include_original: bool) -> str:
+        """构建SSE格式的错误帧，供LRU缓存使用"""
+        return f"data: {json_dumps(self.handle_api_error(error_content, include_original))}\n\n"
+
+    def format_sse_error(self, error_content: Union[bytes, str], include_original: bool = False) -> str:
+        """
+        处理API错误，返回SSE格式的用户友好错误帧
+        相同的错误内容直接返回缓存的帧，适用于流式响应中的错误风暴（如大量429）
+        
+        Args:
+            error_content: 原始错误内容（字符串或字节）
+            include_original: 是否包含原始错误信息（用于调试）
+            
+        Returns:
+            "data: ...\n\n" 格式的SSE错误帧
+        """
+        include_original = bool(include_original or getattr(settings, 'DEBUG_MODE', False))
+
+        if not isinstance(error_content, (bytes, str)) or len(error_content) > _RESPONSE_CACHE_MAX_CONTENT_LENGTH:
+            return self._build_sse_error(error_content, include_original)
+        return self._cached_sse_error(error_content, include_original)
+
     def reload_custom_mappings(self) -> None:
         """
         重新加载自定义错误映射配置
@@ -302,7 +464,14 @@ class UserFriendlyErrorHandler:
         """
         logger.info("Reloading custom error mappings...")
         self._load_custom_mappings()
+        self._cached_response.cache_clear()
+        self._cached_sse_error.cache_clear()
 
 
-# 全局实例
-user_friendly_error_handler = UserFriendlyErrorHandler()
\ No newline at end of file
+@lru_cache(maxsize=1)
+def get_user_friendly_error_handler() -> UserFriendlyErrorHandler:
+    """
+    获取全局用户友好错误处理器实例
+    首次调用时才创建，避免在模块导入时扫描环境变量
+    """
+    return UserFriendlyErrorHandler()
\ No newline at end of file
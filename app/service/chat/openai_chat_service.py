@@ -19,7 +19,7 @@ from app.handler.message_converter import OpenAIMessageConverter
 from app.handler.response_handler import OpenAIResponseHandler
 from app.handler.stream_optimizer import openai_optimizer
 from app.log.logger import get_openai_logger
-from app.service.client.api_client import GeminiApiClient
+from app.service.client.api_client import get_gemini_client
 from app.service.image.image_create_service import ImageCreateService
 from app.service.key.key_manager import KeyManager
 
@@ -160,7 +160,7 @@ class OpenAIChatService:
     def __init__(self, base_url: str, key_manager: KeyManager = None):
         self.message_converter = OpenAIMessageConverter()
         self.response_handler = OpenAIResponseHandler(config=None)
-        self.api_client = GeminiApiClient(base_url, settings.TIME_OUT)
+        self.api_client = get_gemini_client(base_url, settings.TIME_OUT)
         self.key_manager = key_manager
         self.image_create_service = ImageCreateService()
 
@@ -239,8 +239,8 @@ class OpenAIChatService:
             
             # 生成友好的错误响应返回给用户
             if settings.USER_FRIENDLY_ERRORS_ENABLED:
-                from app.handler.user_friendly_errors import user_friendly_error_handler
-                friendly_response = user_friendly_error_handler.handle_api_error(
+                from app.handler.user_friendly_errors import get_user_friendly_error_handler
+                friendly_response = get_user_friendly_error_handler().handle_api_error(
                     error_log_msg,
                     include_original=settings.INCLUDE_TECHNICAL_DETAILS
                 )
@@ -505,8 +505,8 @@ class OpenAIChatService:
             
             # 返回原始Google API错误响应给用户
             if settings.USER_FRIENDLY_ERRORS_ENABLED:
-                from app.handler.user_friendly_errors import user_friendly_error_handler
-                friendly_response = user_friendly_error_handler.handle_api_error(
+                from app.handler.user_friendly_errors import get_user_friendly_error_handler
+                friendly_response = get_user_friendly_error_handler().handle_api_error(
                     original_error_msg,  # 使用原始错误而不是重试错误
                     include_original=settings.INCLUDE_TECHNICAL_DETAILS
                 )
@@ -645,8 +645,8 @@ class OpenAIChatService:
             
             # 返回友好错误响应而不是抛出异常
             if settings.USER_FRIENDLY_ERRORS_ENABLED:
-                from app.handler.user_friendly_errors import user_friendly_error_handler
-                friendly_response = user_friendly_error_handler.handle_api_error(
+                from app.handler.user_friendly_errors import get_user_friendly_error_handler
+                friendly_response = get_user_friendly_error_handler().handle_api_error(
                     error_log_msg,
                     include_original=settings.INCLUDE_TECHNICAL_DETAILS
                 )
@@ -11,7 +11,7 @@ from app.domain.gemini_models import GeminiRequest
 from app.handler.response_handler import GeminiResponseHandler
 from app.handler.stream_optimizer import gemini_optimizer
 from app.log.logger import get_gemini_logger
-from app.service.client.api_client import GeminiApiClient
+from app.service.client.api_client import get_gemini_client
 from app.service.key.key_manager import KeyManager
 from app.database.services import add_error_log, add_request_log
 
@@ -110,7 +110,7 @@ class GeminiChatService:
     """聊天服务"""
 
     def __init__(self, base_url: str, key_manager: KeyManager):
-        self.api_client = GeminiApiClient(base_url, settings.TIME_OUT)
+        self.api_client = get_gemini_client(base_url, settings.TIME_OUT)
         self.key_manager = key_manager
         self.response_handler = GeminiResponseHandler()
 
@@ -175,8 +175,8 @@ class GeminiChatService:
             
             # 生成友好的错误响应返回给用户
             if settings.USER_FRIENDLY_ERRORS_ENABLED:
-                from app.handler.user_friendly_errors import user_friendly_error_handler
-                friendly_response = user_friendly_error_handler.handle_api_error(
+                from app.handler.user_friendly_errors import get_user_friendly_error_handler
+                friendly_response = get_user_friendly_error_handler().handle_api_error(
                     error_log_msg,
                     include_original=settings.INCLUDE_TECHNICAL_DETAILS
                 )
@@ -297,8 +297,8 @@ class GeminiChatService:
                     
                     # 达到最大重试次数后，返回原始Google API错误响应给用户
                     if settings.USER_FRIENDLY_ERRORS_ENABLED:
-                        from app.handler.user_friendly_errors import user_friendly_error_handler
-                        friendly_response = user_friendly_error_handler.handle_api_error(
+                        from app.handler.user_friendly_errors import get_user_friendly_error_handler
+                        friendly_response = get_user_friendly_error_handler().handle_api_error(
                             original_error_msg,  # 使用原始错误而不是重试错误
                             include_original=settings.INCLUDE_TECHNICAL_DETAILS
                         )
@@ -1,25 +1,557 @@
 # app/services/chat/api_client.py
 
-from typing import Dict, Any, AsyncGenerator, Optional
+from typing import Dict, Any, AsyncGenerator, AsyncIterator, List, Mapping, Optional, Sequence, Set, Tuple, Union
+import asyncio
 import httpx
-import json
+import logging
+import math
 import random
+import re
+import time
+import zlib
 from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from types import MappingProxyType
 from app.config.config import settings
 from app.log.logger import get_api_client_logger
-from app.handler.user_friendly_errors import user_friendly_error_handler
+from app.handler.user_friendly_errors import get_user_friendly_error_handler
+from app.utils.helpers import json_dumps, json_dumps_bytes, json_loads
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+try:
+    import h2
+except ImportError:
+    h2 = None
 
 DEFAULT_TIMEOUT = 30
 logger = get_api_client_logger()
 
+# 按代理复用的 httpx 客户端，所有 ApiClient 实例共享连接池，避免每次请求重新建立 TCP/TLS 连接；
+# 默认使用 HTTP/1.1 连接池；HTTP/2 需通过 HTTP2_ENABLED 显式开启，开启后每个代理只使用一条连接，
+# 并发流数受服务端和 h2 的上限（100）约束，超出的请求会排队等待，未安装 h2 时仍使用 HTTP/1.1
+_HTTP_LIMITS = httpx.Limits(max_connections=200, max_keepalive_connections=100, keepalive_expiry=30)
+_http_clients: Dict[Optional[str], httpx.AsyncClient] = {}
+
+# 模型名称上的功能后缀（可任意组合），请求上游前需要去除
+_MODEL_SUFFIX_RE = re.compile(r"(?:-search|-image|-non-thinking)+$")
+
+# 代理随机选择使用独立的随机数生成器，不与全局 random 模块共享状态
+_proxy_rng = random.Random()
+
+# SSE 数据行的字段前缀
+_SSE_DATA_PREFIX = b"data:"
+
+# 获取模型列表使用较短的超时
+_MODELS_TIMEOUT = httpx.Timeout(5)
+
+# 流式请求出错时最多读取的错误响应体字节数
+_ERROR_BODY_MAX_BYTES = 8192
+
+# 请求体由 json_dumps_bytes 预先序列化，需要显式声明内容类型
+_JSON_CONTENT_TYPE = {"Content-Type": "application/json"}
+
+
+# 各共享客户端上进行中的请求数（流式请求持续到流结束），以及已从代理列表移除、
+# 等待进行中的请求结束后再关闭的客户端及其超时强制关闭任务
+_http_client_inflight: Dict[httpx.AsyncClient, int] = {}
+_retired_http_clients: Dict[httpx.AsyncClient, asyncio.Task] = {}
+
+
+async def close_http_clients() -> None:
+    """关闭所有共享的 httpx 客户端，在应用关闭时调用"""
+    clients = list(_http_clients.values()) + list(_retired_http_clients)
+    _http_clients.clear()
+    for task in _retired_http_clients.values():
+        task.cancel()
+    _retired_http_clients.clear()
+    for client in clients:
+        await client.aclose()
+
+
+async def _close_retired_client_later(client: httpx.AsyncClient, delay: float) -> None:
+    """超过等待时间仍有请求未结束时强制关闭已移除代理的客户端"""
+    await asyncio.sleep(delay)
+    if _retired_http_clients.pop(client, None) is not None:
+        await client.aclose()
+
+
+async def _release_http_client(client: httpx.AsyncClient) -> None:
+    """一次请求结束，已移除代理的客户端在最后一个请求结束后关闭"""
+    remaining = _http_client_inflight.get(client, 1) - 1
+    if remaining > 0:
+        _http_client_inflight[client] = remaining
+        return
+    _http_client_inflight.pop(client, None)
+    task = _retired_http_clients.pop(client, None)
+    if task is not None:
+        task.cancel()
+        await client.aclose()
+
+
+async def close_unused_http_clients() -> None:
+    """
+    停用已从 settings.PROXIES 中移除的代理对应的客户端，并清理其延迟数据
+
+    在代理配置更新后调用。客户端立即停止接收新请求，空闲的直接关闭；
+    有进行中的请求时等这些请求结束后再关闭，最多等待 settings.TIME_OUT 秒
+    """
+    proxies = set(settings.PROXIES or ())
+    _proxy_latency.prune(proxies)
+    removed = [proxy for proxy in _http_clients if proxy is not None and proxy not in proxies]
+    for proxy in removed:
+        client = _http_clients.pop(proxy)
+        if client in _http_client_inflight:
+            _retired_http_clients[client] = asyncio.create_task(
+                _close_retired_client_later(client, settings.TIME_OUT)
+            )
+        else:
+            await client.aclose()
+
+
+class ProxyLatencyTracker:
+    """
+    记录各代理的响应延迟（EWMA），按 power-of-two-choices 选择代理
+
+    每次按延迟倒数加权抽取两个代理，选择延迟较低的一个；延迟相差在容差范围内时保留第一个，
+    避免流量在代理之间来回摆动。
+
+    延迟估计由两部分组成：成功请求的延迟 EWMA，以及单独记录、随成功请求衰减的失败惩罚。
+    有成功响应但没有延迟样本的代理按其他代理成功延迟的平均值估计；没有任何数据或数据已过期的
+    代理同样按平均值估计，但同一时间只放行一个探测请求，出过错的代理也能在一段时间后重新获得少量流量
+    """
+
+    # 计算权重时的延迟下限（秒），避免延迟极低的代理权重过大
+    _LATENCY_FLOOR = 0.05
+    # 延迟变化超过该比例时才重新计算权重
+    _WEIGHT_REFRESH_RATIO = 0.2
+    # 权重缓存的最长有效期（秒），保证过期数据能及时恢复
+    _WEIGHT_MAX_AGE = 1.0
+
+    def __init__(self, alpha: float = 0.3, tolerance: float = 0.1, recovery_interval: float = 60.0):
+        self._alpha = alpha
+        self._tolerance = tolerance
+        self._recovery_interval = recovery_interval
+        # 成功请求的延迟 EWMA（没有延迟样本时为None）及最近一次成功的时间
+        self._stats: Dict[str, Tuple[Optional[float], float]] = {}
+        # 失败惩罚（秒）及最近一次更新的时间
+        self._penalties: Dict[str, Tuple[float, float]] = {}
+        # 正在探测的代理及探测开始时间，探测超过 DEFAULT_TIMEOUT 仍未结束时视为已结束
+        self._probes: Dict[str, float] = {}
+        self._version = 0
+        self._weights_key: Optional[Tuple[Tuple[str, ...], int]] = None
+        self._weights: list = []
+        self._weights_computed_at = 0.0
+
+    def _significant(self, old: float, new: float) -> bool:
+        return abs(new - old) > self._WEIGHT_REFRESH_RATIO * max(old, self._LATENCY_FLOOR)
+
+    def record(self, proxy: str, latency: Optional[float] = None) -> None:
+        """
+        记录一次成功的响应
+
+        Args:
+            proxy: 代理地址
+            latency: 本次请求的延迟（秒），未采集延迟时为None
+        """
+        now = time.monotonic()
+        if not self._known(proxy, now):
+            self._version += 1
+        ewma = self._fresh_latency(proxy, now)
+        if latency is not None:
+            if ewma is None:
+                ewma = latency
+                self._version += 1
+            else:
+                updated = ewma + self._alpha * (latency - ewma)
+                if self._significant(ewma, updated):
+                    self._version += 1
+                ewma = updated
+        self._stats[proxy] = (ewma, now)
+        self._update_penalty(proxy, 0.0, now)
+        self.release_probe(proxy)
+
+    def record_failure(self, proxy: str) -> None:
+        """记录一次网络错误，按超时时间计入失败惩罚，不影响成功延迟的统计"""
+        self._update_penalty(proxy, float(DEFAULT_TIMEOUT), time.monotonic())
+        self.release_probe(proxy)
+
+    def _update_penalty(self, proxy: str, sample: float, now: float) -> None:
+        penalty = self._fresh_penalty(proxy, now)
+        if penalty == 0.0 and sample == 0.0:
+            self._penalties.pop(proxy, None)
+            return
+        updated = penalty + self._alpha * (sample - penalty)
+        if self._significant(penalty, updated):
+            self._version += 1
+        self._penalties[proxy] = (updated, now)
+
+    def prune(self, proxies: Set[str]) -> None:
+        """清理不在给定代理集合中的延迟数据、失败惩罚和探测记录"""
+        for table in (self._stats, self._penalties, self._probes):
+            for proxy in [proxy for proxy in table if proxy not in proxies]:
+                del table[proxy]
+        self._version += 1
+
+    def release_probe(self, proxy: str) -> None:
+        """结束代理上的探测请求"""
+        if self._probes.pop(proxy, None) is not None:
+            self._version += 1
+
+    def _known(self, proxy: str, now: float) -> bool:
+        """代理在恢复间隔内是否有过成功或失败的记录"""
+        stats = self._stats.get(proxy)
+        if stats is not None and now - stats[1] <= self._recovery_interval:
+            return True
+        penalty = self._penalties.get(proxy)
+        return penalty is not None and now - penalty[1] <= self._recovery_interval
+
+    def _fresh_latency(self, proxy: str, now: float) -> Optional[float]:
+        """获取代理未过期的成功延迟 EWMA，没有时返回None"""
+        stats = self._stats.get(proxy)
+        if stats is None or now - stats[1] > self._recovery_interval:
+            return None
+        return stats[0]
+
+    def _fresh_penalty(self, proxy: str, now: float) -> float:
+        penalty = self._penalties.get(proxy)
+        if penalty is None or now - penalty[1] > self._recovery_interval:
+            return 0.0
+        return penalty[0]
+
+    def _probing(self, proxy: str, now: float) -> bool:
+        started = self._probes.get(proxy)
+        return started is not None and now - started < DEFAULT_TIMEOUT
+
+    def _mean_latency(self, now: float) -> float:
+        """各代理成功延迟的平均值，不含失败惩罚，都没有数据时为 0"""
+        known = [
+            ewma for ewma, updated in self._stats.values()
+            if ewma is not None and now - updated <= self._recovery_interval
+        ]
+        return sum(known) / len(known) if known else 0.0
+
+    def _estimate(self, proxy: str, now: float, mean_latency: float) -> float:
+        if not self._known(proxy, now) and self._probing(proxy, now):
+            return math.inf
+        latency = self._fresh_latency(proxy, now)
+        if latency is None:
+            latency = mean_latency
+        return latency + self._fresh_penalty(proxy, now)
+
+    def latency(self, proxy: str) -> float:
+        """
+        获取代理当前的延迟估计（成功延迟加失败惩罚）
+
+        没有延迟样本时按其他代理成功延迟的平均值估计（都没有时为 0）；
+        没有任何数据且已有探测请求在进行中时返回无穷大，不再分配新的请求
+        """
+        now = time.monotonic()
+        return self._estimate(proxy, now, self._mean_latency(now))
+
+    def _inverse_latency_weights(self, proxies: Sequence[str]) -> list:
+        """
+        获取各代理的延迟倒数权重，只在延迟明显变化或缓存过期时重新计算
+
+        未知代理按平均延迟计算权重，不会因延迟下限得到最大权重；探测中的代理权重为 0
+        """
+        key = (tuple(proxies), self._version)
+        now = time.monotonic()
+        if key != self._weights_key or now - self._weights_computed_at > self._WEIGHT_MAX_AGE:
+            mean_latency = self._mean_latency(now)
+            self._weights = [
+                1.0 / max(self._estimate(proxy, now, mean_latency), self._LATENCY_FLOOR) for proxy in proxies
+            ]
+            self._weights_key = key
+            self._weights_computed_at = now
+        return self._weights
+
+    def choose(self, proxies: Sequence[str]) -> str:
+        """从代理列表中选择一个代理，选中没有有效数据的代理时开始一次探测"""
+        if len(proxies) == 1:
+            return proxies[0]
+        weights = self._inverse_latency_weights(proxies)
+        if not any(weights):
+            # 所有代理都在探测中，没有可比较的数据
+            return _proxy_rng.choice(proxies)
+        first, second = _proxy_rng.choices(proxies, weights=weights, k=2)
+        proxy = second if self.latency(second) < self.latency(first) * (1 - self._tolerance) else first
+        now = time.monotonic()
+        if not self._known(proxy, now) and not self._probing(proxy, now):
+            self._probes[proxy] = now
+            self._version += 1
+        return proxy
+
+
+_proxy_latency = ProxyLatencyTracker()
+
+# 需要采集代理延迟的请求在 extensions 中带上该标记。只有流式请求和获取模型列表会采集：
+# 流式响应在模型开始输出时即返回响应头，而非流式请求的响应头要等整个生成完成，
+# 其耗时主要取决于提示词和输出长度，不能反映代理的状况
+_LATENCY_SAMPLE_KEY = "proxy_latency_sample"
+_LATENCY_SAMPLE_EXTENSIONS = {_LATENCY_SAMPLE_KEY: True}
+
+
+def _latency_event_hooks(proxy: str) -> Dict[str, list]:
+    """
+    构建记录代理延迟的 httpx 事件钩子
+
+    响应钩子在收到响应头时触发，记录的是首字节时间；未采集延迟的请求只记录一次成功
+    """
+    async def on_request(request: httpx.Request) -> None:
+        if request.extensions.get(_LATENCY_SAMPLE_KEY):
+            request.extensions["proxy_request_start"] = time.perf_counter()
+
+    async def on_response(response: httpx.Response) -> None:
+        start = response.request.extensions.get("proxy_request_start")
+        if start is not None:
+            _proxy_latency.record(proxy, time.perf_counter() - start)
+        else:
+            _proxy_latency.record(proxy)
+
+    return {"request": [on_request], "response": [on_response]}
+
+
+@lru_cache(maxsize=256)
+def _strip_model_suffixes(model: str) -> str:
+    """去除模型名称上的功能后缀，模型名称种类有限，结果直接缓存"""
+    return _MODEL_SUFFIX_RE.sub("", model)
+
+
+@lru_cache(maxsize=256)
+def _auth_headers(api_key: str, json_body: bool = False) -> Mapping[str, str]:
+    """
+    构建OpenAI兼容接口的认证请求头，按密钥缓存
+
+    返回只读映射，缓存的请求头不会被调用方修改；httpx 会复制传入的请求头
+
+    Args:
+        api_key: API密钥
+        json_body: 是否附带JSON请求体的 Content-Type
+    """
+    headers = {"Authorization": f"Bearer {api_key}"}
+    if json_body:
+        headers.update(_JSON_CONTENT_TYPE)
+    return MappingProxyType(headers)
+
+
+@lru_cache(maxsize=4096)
+def _proxy_index(api_key: str, proxy_count: int) -> int:
+    """
+    计算API密钥对应的代理下标
+
+    使用跨进程稳定的哈希（xxhash，未安装时回退到 crc32），
+    保证多个 worker 为同一密钥选中同一个代理
+    """
+    if xxhash is not None:
+        return xxhash.xxh64_intdigest(api_key) % proxy_count
+    return zlib.crc32(api_key.encode("utf-8")) % proxy_count
+
+
+def _select_proxy(api_key: str) -> Optional[str]:
+    """
+    为当前请求选择代理
+
+    Args:
+        api_key: 当前请求使用的API密钥，启用一致性哈希时用于固定代理
+
+    Returns:
+        选中的代理地址，未配置代理时返回None
+    """
+    proxies = settings.PROXIES
+    if not proxies:
+        return None
+    if settings.PROXIES_USE_CONSISTENCY_HASH_BY_API_KEY:
+        proxy = proxies[_proxy_index(api_key, len(proxies))]
+    else:
+        proxy = _proxy_latency.choose(proxies)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Using proxy: %s", proxy)
+    return proxy
+
+
+# 上游错误日志去重：相同状态码和内容的错误在窗口期内只记录一次，日志中的错误内容截断到固定长度
+_ERROR_LOG_DEDUP_WINDOW = 1.0
+_ERROR_LOG_MAX_CONTENT_LENGTH = 512
+_last_error_logged: Dict[Tuple[int, int], float] = {}
+
+
+def _log_api_error(status_code: int, error_content: Union[bytes, str]) -> None:
+    """
+    记录上游API错误日志
+
+    客户端错误（401/403 除外）记为 warning，其余记为 error；
+    同一错误在去重窗口内重复出现时不再记录，避免限流时日志刷屏
+    """
+    key = (status_code, hash(error_content) & 0xFFFF)
+    now = time.monotonic()
+    if now - _last_error_logged.get(key, 0.0) < _ERROR_LOG_DEDUP_WINDOW:
+        return
+    _last_error_logged[key] = now
+
+    content = error_content[:_ERROR_LOG_MAX_CONTENT_LENGTH]
+    if isinstance(content, bytes):
+        content = content.decode("utf-8", errors="replace")
+    if 400 <= status_code < 500 and status_code not in (401, 403):
+        logger.warning("API error occurred (%s): %s", status_code, content)
+    else:
+        logger.error("API error occurred (%s): %s", status_code, content)
+
+
+def _build_error_response(status_code: int, error_content: Union[bytes, str]) -> Dict[str, Any]:
+    """
+    根据上游错误内容生成返回给用户的错误响应
+
+    Args:
+        status_code: HTTP状态码
+        error_content: 原始错误内容
+
+    Returns:
+        友好错误响应，未启用友好错误时为原始错误信息的标准化格式
+    """
+    if settings.USER_FRIENDLY_ERRORS_ENABLED:
+        # 使用用户友好错误处理器
+        return get_user_friendly_error_handler().handle_api_error(
+            error_content,
+            include_original=settings.INCLUDE_TECHNICAL_DETAILS
+        )
+    if isinstance(error_content, bytes):
+        error_content = error_content.decode("utf-8", errors="replace")
+    # 返回原始错误信息的标准化格式
+    return {
+        "error": {
+            "code": status_code,
+            "message": error_content,
+            "status": "FAILED"
+        }
+    }
+
+
+def _format_sse_error(status_code: int, error_msg: Union[bytes, str]) -> str:
+    """
+    生成流式响应中返回给客户端的SSE错误帧
+
+    Args:
+        status_code: HTTP状态码
+        error_msg: 原始错误内容，字节内容只在需要展示原文时才解码
+
+    Returns:
+        "data: ...\n\n" 格式的SSE错误帧
+    """
+    if settings.USER_FRIENDLY_ERRORS_ENABLED:
+        return get_user_friendly_error_handler().format_sse_error(
+            error_msg,
+            include_original=settings.INCLUDE_TECHNICAL_DETAILS
+        )
+    return f"data: {json_dumps(_build_error_response(status_code, error_msg))}\n\n"
+
+
+async def _aiter_data_line_batches(response: httpx.Response) -> AsyncGenerator[List[str], None]:
+    """
+    按网络分块迭代SSE流式响应，每次产出一个分块中所有完整的 "data:" 数据行
+
+    在字节缓冲区上按换行符切分，并记录已扫描位置，超长的单行（如内联 base64 图片）
+    跨多个网络分块到达时不会被重复扫描。字段名直接在字节上匹配，空行、注释以及
+    event:/id: 等非数据行在解码前就被丢弃，数据行只在产出时解码一次。
+    产出的行保留 "data:" 前缀，不含行尾的 \n 或 \r\n
+
+    Args:
+        response: 已建立的流式响应
+
+    Yields:
+        非空的数据行列表
+    """
+    buffer = bytearray()
+    scan_pos = 0
+    # 不指定 chunk_size：httpx 会把分块攒满到指定大小才返回，从而延迟流式输出；
+    # httpcore 每次已按最多 64 KiB 读取 socket，数据积压时得到的分块本身就足够大
+    async for chunk in response.aiter_bytes():
+        buffer.extend(chunk)
+        lines = []
+        start = 0
+        while True:
+            newline = buffer.find(b"\n", max(start, scan_pos))
+            if newline < 0:
+                break
+            if buffer.startswith(_SSE_DATA_PREFIX, start):
+                end = newline - 1 if buffer[newline - 1] == 0x0D else newline
+                lines.append(buffer[start:end].decode("utf-8", errors="replace"))
+            start = newline + 1
+        if start:
+            del buffer[:start]
+        # 剩余内容中没有换行符，下一个分块从这里继续扫描
+        scan_pos = len(buffer)
+        if lines:
+            yield lines
+    if buffer.startswith(_SSE_DATA_PREFIX):
+        if buffer[-1] == 0x0D:
+            del buffer[-1]
+        yield [buffer.decode("utf-8", errors="replace")]
+
+
+async def _aiter_data_lines(response: httpx.Response) -> AsyncGenerator[str, None]:
+    """
+    按行迭代SSE流式响应，只产出 "data:" 数据行，格式同 _aiter_data_line_batches
+
+    Args:
+        response: 已建立的流式响应
+
+    Yields:
+        响应中的每一条数据行
+    """
+    async for lines in _aiter_data_line_batches(response):
+        for line in lines:
+            yield line
+
+
+async def _aread_error_body(response: httpx.Response) -> bytes:
+    """
+    读取流式响应的错误内容，最多读取 _ERROR_BODY_MAX_BYTES 字节
+
+    上游限流时可能返回很大的 HTML 错误页，完整读取会占用内存并长时间占住连接，
+    错误提示只需要开头部分
+
+    Args:
+        response: 状态码非200的流式响应
+
+    Returns:
+        截断后的错误内容字节
+    """
+    # 按上限分块读取，只取第一个分块
+    async for chunk in response.aiter_bytes(chunk_size=_ERROR_BODY_MAX_BYTES):
+        return chunk
+    return b""
+
 
 class ApiErrorWithResponse(Exception):
-    """包含友好错误响应的API异常"""
+    """
+    包含友好错误响应的API异常
+
+    友好错误响应在首次访问 error_response 时才生成，只记录日志或重试的调用方
+    不需要为错误内容的解析和匹配付出开销
+    """
     
-    def __init__(self, message: str, status_code: int, error_response: Dict[str, Any]):
+    def __init__(
+        self,
+        message: str,
+        status_code: int,
+        error_response: Optional[Dict[str, Any]] = None,
+        error_content: Union[bytes, str] = "",
+    ):
         super().__init__(message)
         self.status_code = status_code
-        self.error_response = error_response
+        self.error_content = error_content
+        self._error_response = error_response
+
+    @property
+    def error_response(self) -> Dict[str, Any]:
+        if self._error_response is None:
+            self._error_response = _build_error_response(self.status_code, self.error_content)
+        return self._error_response
 
 
 class ApiClient(ABC):
@@ -33,46 +565,84 @@ class ApiClient(ABC):
     async def stream_generate_content(self, payload: Dict[str, Any], model: str, api_key: str) -> AsyncGenerator[str, None]:
         pass
 
-    def _handle_api_error(self, status_code: int, error_content: str) -> Dict[str, Any]:
+    def _get_client(self, proxy: Optional[str]) -> httpx.AsyncClient:
+        """获取指定代理对应的共享客户端，不存在或已关闭时创建"""
+        client = _http_clients.get(proxy)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                timeout=DEFAULT_TIMEOUT,
+                proxy=proxy,
+                limits=_HTTP_LIMITS,
+                http2=settings.HTTP2_ENABLED and h2 is not None,
+                event_hooks=_latency_event_hooks(proxy) if proxy else None,
+            )
+            _http_clients[proxy] = client
+        return client
+
+    @asynccontextmanager
+    async def _request_client(self, api_key: str) -> AsyncIterator[httpx.AsyncClient]:
+        """
+        为一次上游请求选择代理并提供共享客户端
+
+        所有请求方法都通过这里获取客户端，代理选择、连接池复用和网络错误日志只在此处实现
+
+        Args:
+            api_key: 当前请求使用的API密钥
+
+        Yields:
+            与所选代理对应的共享 httpx 客户端
+        """
+        proxy_to_use = _select_proxy(api_key)
+        client = self._get_client(proxy_to_use)
+        _http_client_inflight[client] = _http_client_inflight.get(client, 0) + 1
+        try:
+            yield client
+        except httpx.RequestError as e:
+            logger.error("Request to upstream failed via proxy %s: %r", proxy_to_use, e)
+            if proxy_to_use:
+                _proxy_latency.record_failure(proxy_to_use)
+            raise
+        finally:
+            await _release_http_client(client)
+
+    def _read_json(self, response: httpx.Response) -> Dict[str, Any]:
         """
-        统一处理API错误，生成友好错误响应并抛出异常
+        解析成功响应的JSON内容，状态码非2xx时转换为API异常
+
+        成功路径直接解析响应字节，不会把响应体解码为字符串
         
         Args:
-            status_code: HTTP状态码
-            error_content: 原始错误内容
+            response: 上游响应
             
         Returns:
-            不会实际返回，总是抛出异常
+            解析后的响应内容
             
         Raises:
-            ApiErrorWithResponse: 包含友好错误响应的异常
+            ApiErrorWithResponse: 上游返回错误状态码
         """
-        # 生成友好的错误响应
-        if settings.USER_FRIENDLY_ERRORS_ENABLED:
-            # 使用用户友好错误处理器
-            friendly_response = user_friendly_error_handler.handle_api_error(
-                error_content, 
-                include_original=settings.INCLUDE_TECHNICAL_DETAILS
-            )
-        else:
-            # 返回原始错误信息的标准化格式
-            friendly_response = {
-                "error": {
-                    "code": status_code,
-                    "message": error_content,
-                    "status": "FAILED"
-                }
-            }
+        try:
+            response.raise_for_status()
+        except httpx.HTTPStatusError as e:
+            raise self._handle_api_error(e.response.status_code, e.response.text) from e
+        return json_loads(response.content)
+
+    def _handle_api_error(self, status_code: int, error_content: str) -> ApiErrorWithResponse:
+        """
+        统一处理API错误，记录日志并生成异常，由调用方抛出
         
-        # 创建包含友好响应的异常
-        error_exception = ApiErrorWithResponse(
+        Args:
+            status_code: HTTP状态码
+            error_content: 原始错误内容
+            
+        Returns:
+            ApiErrorWithResponse: 包含友好错误响应的异常，友好错误响应按需生成
+        """
+        _log_api_error(status_code, error_content)
+        return ApiErrorWithResponse(
             message=f"API call failed with status {status_code}: {error_content}",
             status_code=status_code,
-            error_response=friendly_response
+            error_content=error_content,
         )
-        
-        logger.error(f"API error occurred: {error_content}")
-        raise error_exception
 
 
 class GeminiApiClient(ApiClient):
@@ -81,104 +651,71 @@ class GeminiApiClient(ApiClient):
     def __init__(self, base_url: str, timeout: int = DEFAULT_TIMEOUT):
         self.base_url = base_url
         self.timeout = timeout
+        # 超时配置和模型列表地址与单次请求无关，在构造时生成
+        self._timeout = httpx.Timeout(timeout, read=timeout)
+        self._models_url = f"{base_url}/models"
 
     def _get_real_model(self, model: str) -> str:
-        if model.endswith("-search"):
-            model = model[:-7]
-        if model.endswith("-image"):
-            model = model[:-6]
-        if model.endswith("-non-thinking"):
-            model = model[:-13]
-        if "-search" in model and "-non-thinking" in model:
-            model = model[:-20]
-        return model
+        return _strip_model_suffixes(model)
 
     async def get_models(self, api_key: str) -> Optional[Dict[str, Any]]:
         """获取可用的 Gemini 模型列表"""
-        timeout = httpx.Timeout(timeout=5)
-        
-        proxy_to_use = None
-        if settings.PROXIES:
-            if settings.PROXIES_USE_CONSISTENCY_HASH_BY_API_KEY:
-                proxy_to_use = settings.PROXIES[hash(api_key) % len(settings.PROXIES)]
-            else:
-                proxy_to_use = random.choice(settings.PROXIES)
-            logger.info(f"Using proxy for getting models: {proxy_to_use}")
-
-        async with httpx.AsyncClient(timeout=timeout, proxy=proxy_to_use) as client:
-            url = f"{self.base_url}/models?key={api_key}&pageSize=1000"
-            try:
-                response = await client.get(url)
+        # 网络错误在 _request_client 之外处理，保证代理的失败记录能正常写入
+        try:
+            async with self._request_client(api_key) as client:
+                response = await client.get(
+                    self._models_url,
+                    params={"key": api_key, "pageSize": 1000},
+                    timeout=_MODELS_TIMEOUT,
+                    extensions=_LATENCY_SAMPLE_EXTENSIONS,
+                )
                 response.raise_for_status()
-                return response.json()
-            except httpx.HTTPStatusError as e:
-                logger.error(f"获取模型列表失败: {e.response.status_code}")
-                logger.error(e.response.text)
-                return None
-            except httpx.RequestError as e:
-                logger.error(f"请求模型列表失败: {e}")
-                return None
-            
+                return json_loads(response.content)
+        except httpx.HTTPStatusError as e:
+            logger.error("获取模型列表失败: %s", e.response.status_code)
+            logger.error(e.response.text)
+            return None
+        except httpx.RequestError as e:
+            logger.error("请求模型列表失败: %s", e)
+            return None
+
     async def generate_content(self, payload: Dict[str, Any], model: str, api_key: str) -> Dict[str, Any]:
-        timeout = httpx.Timeout(self.timeout, read=self.timeout)
         model = self._get_real_model(model)
 
-        proxy_to_use = None
-        if settings.PROXIES:
-            if settings.PROXIES_USE_CONSISTENCY_HASH_BY_API_KEY:
-                proxy_to_use = settings.PROXIES[hash(api_key) % len(settings.PROXIES)]
-            else:
-                proxy_to_use = random.choice(settings.PROXIES)
-            logger.info(f"Using proxy for getting models: {proxy_to_use}")
-            
-        async with httpx.AsyncClient(timeout=timeout, proxy=proxy_to_use) as client:
-            url = f"{self.base_url}/models/{model}:generateContent?key={api_key}"
-            response = await client.post(url, json=payload)
-            if response.status_code != 200:
-                error_content = response.text
-                return self._handle_api_error(response.status_code, error_content)
-            return response.json()
+        async with self._request_client(api_key) as client:
+            url = f"{self.base_url}/models/{model}:generateContent"
+            response = await client.post(
+                url,
+                params={"key": api_key},
+                content=json_dumps_bytes(payload),
+                headers=_JSON_CONTENT_TYPE,
+                timeout=self._timeout,
+            )
+            return self._read_json(response)
 
     async def stream_generate_content(self, payload: Dict[str, Any], model: str, api_key: str) -> AsyncGenerator[str, None]:
-        timeout = httpx.Timeout(self.timeout, read=self.timeout)
         model = self._get_real_model(model)
         
-        proxy_to_use = None
-        if settings.PROXIES:
-            if settings.PROXIES_USE_CONSISTENCY_HASH_BY_API_KEY:
-                proxy_to_use = settings.PROXIES[hash(api_key) % len(settings.PROXIES)]
-            else:
-                proxy_to_use = random.choice(settings.PROXIES)
-            logger.info(f"Using proxy for getting models: {proxy_to_use}")
-
-        async with httpx.AsyncClient(timeout=timeout, proxy=proxy_to_use) as client:
-            url = f"{self.base_url}/models/{model}:streamGenerateContent?alt=sse&key={api_key}"
-            async with client.stream(method="POST", url=url, json=payload) as response:
-                if response.status_code != 200:
-                    error_content = await response.aread()
-                    error_msg = error_content.decode("utf-8")
+        async with self._request_client(api_key) as client:
+            url = f"{self.base_url}/models/{model}:streamGenerateContent"
+            async with client.stream(
+                method="POST",
+                url=url,
+                params={"alt": "sse", "key": api_key},
+                content=json_dumps_bytes(payload),
+                headers=_JSON_CONTENT_TYPE,
+                timeout=self._timeout,
+                extensions=_LATENCY_SAMPLE_EXTENSIONS,
+            ) as response:
+                if not response.is_success:
+                    error_content = await _aread_error_body(response)
                     # 对于流式响应，我们同时记录错误并返回友好错误响应
-                    logger.error(f"API error occurred: {error_msg}")
-                    
-                    # 生成友好的错误响应
-                    if settings.USER_FRIENDLY_ERRORS_ENABLED:
-                        friendly_response = user_friendly_error_handler.handle_api_error(
-                            error_msg, 
-                            include_original=settings.INCLUDE_TECHNICAL_DETAILS
-                        )
-                    else:
-                        friendly_response = {
-                            "error": {
-                                "code": response.status_code,
-                                "message": error_msg,
-                                "status": "FAILED"
-                            }
-                        }
-                    
+                    _log_api_error(response.status_code, error_content)
+
                     # 以SSE格式返回错误，但不抛出异常（因为这会中断生成器）
-                    yield f"data: {json.dumps(friendly_response)}\n\n"
+                    yield _format_sse_error(response.status_code, error_content)
                     return
-                async for line in response.aiter_lines():
+                async for line in _aiter_data_lines(response):
                     yield line
 
 
@@ -188,111 +725,93 @@ class OpenaiApiClient(ApiClient):
     def __init__(self, base_url: str, timeout: int = DEFAULT_TIMEOUT):
         self.base_url = base_url
         self.timeout = timeout
+        # 超时配置和请求地址与单次请求无关，在构造时生成
+        self._timeout = httpx.Timeout(timeout, read=timeout)
+        self._models_url = f"{base_url}/openai/models"
+        self._chat_url = f"{base_url}/openai/chat/completions"
+        self._embeddings_url = f"{base_url}/openai/embeddings"
+        self._images_url = f"{base_url}/openai/images/generations"
         
-    async def get_models(self, api_key: str) -> Dict[str, Any]:
-        timeout = httpx.Timeout(self.timeout, read=self.timeout)
+    async def _get_json(self, url: str, api_key: str) -> Dict[str, Any]:
+        """发送带认证的GET请求并解析JSON响应"""
+        async with self._request_client(api_key) as client:
+            headers = _auth_headers(api_key)
+            response = await client.get(url, headers=headers, timeout=self._timeout)
+            return self._read_json(response)
 
-        proxy_to_use = None
-        if settings.PROXIES:
-            if settings.PROXIES_USE_CONSISTENCY_HASH_BY_API_KEY:
-                proxy_to_use = settings.PROXIES[hash(api_key) % len(settings.PROXIES)]
-            else:
-                proxy_to_use = random.choice(settings.PROXIES)
-            logger.info(f"Using proxy for getting models: {proxy_to_use}")
-
-        async with httpx.AsyncClient(timeout=timeout, proxy=proxy_to_use) as client:
-            url = f"{self.base_url}/openai/models"
-            headers = {"Authorization": f"Bearer {api_key}"}
-            response = await client.get(url, headers=headers)
-            if response.status_code != 200:
-                error_content = response.text
-                return self._handle_api_error(response.status_code, error_content)
-            return response.json()
+    async def _post_json(self, url: str, payload: Dict[str, Any], api_key: str) -> Dict[str, Any]:
+        """发送带认证的JSON POST请求并解析JSON响应"""
+        async with self._request_client(api_key) as client:
+            headers = _auth_headers(api_key, json_body=True)
+            response = await client.post(url, content=json_dumps_bytes(payload), headers=headers, timeout=self._timeout)
+            return self._read_json(response)
+
+    async def get_models(self, api_key: str) -> Dict[str, Any]:
+        return await self._get_json(self._models_url, api_key)
 
     async def generate_content(self, payload: Dict[str, Any], api_key: str) -> Dict[str, Any]:
-        timeout = httpx.Timeout(self.timeout, read=self.timeout)
-        logger.info(f"settings.PROXIES_USE_CONSISTENCY_HASH_BY_API_KEY: {settings.PROXIES_USE_CONSISTENCY_HASH_BY_API_KEY}")
-        proxy_to_use = None
-        if settings.PROXIES:
-            if settings.PROXIES_USE_CONSISTENCY_HASH_BY_API_KEY:
-                proxy_to_use = settings.PROXIES[hash(api_key) % len(settings.PROXIES)]
-            else:
-                proxy_to_use = random.choice(settings.PROXIES)
-            logger.info(f"Using proxy for getting models: {proxy_to_use}")
-
-        async with httpx.AsyncClient(timeout=timeout, proxy=proxy_to_use) as client:
-            url = f"{self.base_url}/openai/chat/completions"
-            headers = {"Authorization": f"Bearer {api_key}"}
-            response = await client.post(url, json=payload, headers=headers)
-            if response.status_code != 200:
-                error_content = response.text
-                return self._handle_api_error(response.status_code, error_content)
-            return response.json()
+        return await self._post_json(self._chat_url, payload, api_key)
+
+    async def _stream_data_line_batches(self, payload: Dict[str, Any], api_key: str) -> AsyncGenerator[List[str], None]:
+        """发起流式聊天请求，按网络分块产出数据行列表"""
+        async with self._request_client(api_key) as client:
+            headers = _auth_headers(api_key, json_body=True)
+            async with client.stream(
+                method="POST",
+                url=self._chat_url,
+                content=json_dumps_bytes(payload),
+                headers=headers,
+                timeout=self._timeout,
+                extensions=_LATENCY_SAMPLE_EXTENSIONS,
+            ) as response:
+                if not response.is_success:
+                    error_content = await _aread_error_body(response)
+                    error_msg = error_content.decode("utf-8", errors="replace")
+                    raise self._handle_api_error(response.status_code, error_msg)
+                async for lines in _aiter_data_line_batches(response):
+                    yield lines
 
     async def stream_generate_content(self, payload: Dict[str, Any], api_key: str) -> AsyncGenerator[str, None]:
-        timeout = httpx.Timeout(self.timeout, read=self.timeout)
-        proxy_to_use = None
-        if settings.PROXIES:
-            if settings.PROXIES_USE_CONSISTENCY_HASH_BY_API_KEY:
-                proxy_to_use = settings.PROXIES[hash(api_key) % len(settings.PROXIES)]
-            else:
-                proxy_to_use = random.choice(settings.PROXIES)
-            logger.info(f"Using proxy for getting models: {proxy_to_use}")
-
-        async with httpx.AsyncClient(timeout=timeout, proxy=proxy_to_use) as client:
-            url = f"{self.base_url}/openai/chat/completions"
-            headers = {"Authorization": f"Bearer {api_key}"}
-            async with client.stream(method="POST", url=url, json=payload, headers=headers) as response:
-                if response.status_code != 200:
-                    error_content = await response.aread()
-                    error_msg = error_content.decode("utf-8")
-                    error_response = self._handle_api_error(response.status_code, error_msg)
-                    # 对于流式响应，我们需要以SSE格式返回错误
-                    yield f"data: {json.dumps(error_response)}\n\n"
-                    return
-                async for line in response.aiter_lines():
-                    yield line
-    
+        """流式聊天，逐条产出 "data:" 数据行"""
+        async for lines in self._stream_data_line_batches(payload, api_key):
+            for line in lines:
+                yield line
+
+    async def stream_generate_chunks(self, payload: Dict[str, Any], api_key: str) -> AsyncGenerator[str, None]:
+        """
+        流式聊天，把同一网络分块中的数据行合并为一段SSE文本产出
+
+        适合直接转发上游SSE的调用方，每个网络分块只经过一次异步迭代
+
+        Yields:
+            以 "\n\n" 分隔并结尾的一条或多条SSE事件
+        """
+        async for lines in self._stream_data_line_batches(payload, api_key):
+            yield "\n\n".join(lines) + "\n\n"
+
     async def create_embeddings(self, input: str, model: str, api_key: str) -> Dict[str, Any]:
-        timeout = httpx.Timeout(self.timeout, read=self.timeout)
-        
-        proxy_to_use = None
-        if settings.PROXIES:
-            if settings.PROXIES_USE_CONSISTENCY_HASH_BY_API_KEY:
-                proxy_to_use = settings.PROXIES[hash(api_key) % len(settings.PROXIES)]
-            else:
-                proxy_to_use = random.choice(settings.PROXIES)
-            logger.info(f"Using proxy for getting models: {proxy_to_use}")
-
-        async with httpx.AsyncClient(timeout=timeout, proxy=proxy_to_use) as client:
-            url = f"{self.base_url}/openai/embeddings"
-            headers = {"Authorization": f"Bearer {api_key}"}
-            payload = {
-                "input": input,
-                "model": model,
-            }
-            response = await client.post(url, json=payload, headers=headers)
-            if response.status_code != 200:
-                error_content = response.text
-                return self._handle_api_error(response.status_code, error_content)
-            return response.json()
-                    
+        payload = {
+            "input": input,
+            "model": model,
+        }
+        return await self._post_json(self._embeddings_url, payload, api_key)
+
     async def generate_images(self, payload: Dict[str, Any], api_key: str) -> Dict[str, Any]:
-        timeout = httpx.Timeout(self.timeout, read=self.timeout)
+        return await self._post_json(self._images_url, payload, api_key)
 
-        proxy_to_use = None
-        if settings.PROXIES:
-            if settings.PROXIES_USE_CONSISTENCY_HASH_BY_API_KEY:
-                proxy_to_use = settings.PROXIES[hash(api_key) % len(settings.PROXIES)]
-            else:
-                proxy_to_use = random.choice(settings.PROXIES)
-            logger.info(f"Using proxy for getting models: {proxy_to_use}")
-
-        async with httpx.AsyncClient(timeout=timeout, proxy=proxy_to_use) as client:
-            url = f"{self.base_url}/openai/images/generations"
-            headers = {"Authorization": f"Bearer {api_key}"}
-            response = await client.post(url, json=payload, headers=headers)
-            if response.status_code != 200:
-                error_content = response.text
-                return self._handle_api_error(response.status_code, error_content)
-            return response.json()
\ No newline at end of file
+
+@lru_cache(maxsize=32)
+def get_gemini_client(base_url: str, timeout: int = DEFAULT_TIMEOUT) -> GeminiApiClient:
+    """
+    获取进程内共享的 Gemini API 客户端
+
+    按 (base_url, timeout) 缓存实例，服务对象每次请求创建时不必重新构造客户端；
+    实例本身不持有连接，连接池由 close_http_clients 统一关闭
+    """
+    return GeminiApiClient(base_url, timeout)
+
+
+@lru_cache(maxsize=32)
+def get_openai_client(base_url: str, timeout: int = DEFAULT_TIMEOUT) -> OpenaiApiClient:
+    """获取进程内共享的 OpenAI API 客户端，缓存方式同 get_gemini_client"""
+    return OpenaiApiClient(base_url, timeout)
@@ -16,6 +16,7 @@ from app.database.connection import database
 from app.database.models import Settings
 from app.database.services import get_all_settings
 from app.log.logger import get_config_routes_logger
+from app.service.client.api_client import close_unused_http_clients
 from app.service.key.key_manager import (
     get_key_manager_instance,
     reset_key_manager_instance,
@@ -120,6 +121,9 @@ class ConfigService:
         except Exception as e:
             logger.error(f"Failed to re-initialize KeyManager: {str(e)}")
 
+        # 关闭已移除代理的连接池
+        await close_unused_http_clients()
+
         return await ConfigService.get_config()
 
     @staticmethod
@@ -220,7 +224,10 @@ class ConfigService:
             # 根据需要决定是否抛出异常或继续
             # 这里选择记录错误并继续
 
-        # 3. 返回更新后的配置
+        # 3. 关闭已移除代理的连接池
+        await close_unused_http_clients()
+
+        # 4. 返回更新后的配置
         return await ConfigService.get_config()
 
     @staticmethod
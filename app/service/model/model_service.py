@@ -3,14 +3,14 @@ from typing import Any, Dict, Optional
 
 from app.config.config import settings
 from app.log.logger import get_model_logger
-from app.service.client.api_client import GeminiApiClient
+from app.service.client.api_client import get_gemini_client
 
 logger = get_model_logger()
 
 
 class ModelService:
     async def get_gemini_models(self, api_key: str) -> Optional[Dict[str, Any]]:
-        api_client = GeminiApiClient(base_url=settings.BASE_URL)
+        api_client = get_gemini_client(settings.BASE_URL)
         gemini_models = await api_client.get_models(api_key)
 
         if gemini_models is None:
@@ -11,7 +11,7 @@ from app.database.services import (
     add_request_log,
 )
 from app.domain.openai_models import ChatRequest, ImageGenerationRequest
-from app.service.client.api_client import OpenaiApiClient
+from app.service.client.api_client import get_openai_client
 from app.service.key.key_manager import KeyManager
 from app.log.logger import get_openai_compatible_logger
 
@@ -22,7 +22,7 @@ class OpenAICompatiableService:
     def __init__(self, base_url: str, key_manager: KeyManager = None):
         self.key_manager = key_manager
         self.base_url = base_url
-        self.api_client = OpenaiApiClient(base_url, settings.TIME_OUT)
+        self.api_client = get_openai_client(base_url, settings.TIME_OUT)
         
     async def get_models(self, api_key: str) -> Dict[str, Any]:
         return await self.api_client.get_models(api_key)
@@ -122,12 +122,10 @@ class OpenAICompatiableService:
             current_attempt_key = api_key
             final_api_key = current_attempt_key
             try:
-                async for line in self.api_client.stream_generate_content(
+                async for chunk in self.api_client.stream_generate_chunks(
                     payload, current_attempt_key
                 ):
-                    if line.startswith("data:"):
-                        # print(line)
-                        yield line + "\n\n"
+                    yield chunk
                 logger.info("Streaming completed successfully")
                 is_success = True
                 status_code = 200
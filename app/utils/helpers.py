@@ -11,6 +11,11 @@ import logging
 
 from app.core.constants import DATA_URL_PATTERN, IMAGE_URL_PATTERN, VALID_IMAGE_RATIOS
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 helper_logger = logging.getLogger("app.utils")
 
 PROJECT_ROOT = Path(__file__).resolve().parent.parent.parent
@@ -77,6 +82,54 @@ def format_json_response(data: Dict[str, Any], indent: int = 2) -> str:
     return json.dumps(data, indent=indent, ensure_ascii=False)
 
 
+def json_loads(data: Any) -> Any:
+    """
+    解析JSON，安装了orjson时使用C实现，否则回退到标准库
+    
+    Args:
+        data: JSON字符串或字节
+        
+    Returns:
+        解析后的对象
+        
+    Raises:
+        json.JSONDecodeError: JSON格式错误（orjson.JSONDecodeError是其子类）
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def json_dumps(data: Any) -> str:
+    """
+    序列化为JSON字符串，安装了orjson时使用C实现，否则回退到标准库
+    
+    Args:
+        data: 要序列化的对象
+        
+    Returns:
+        str: JSON字符串
+    """
+    if orjson is not None:
+        return orjson.dumps(data).decode("utf-8")
+    return json.dumps(data)
+
+
+def json_dumps_bytes(data: Any) -> bytes:
+    """
+    序列化为UTF-8编码的JSON字节，用作HTTP请求体，避免再做一次字符串编码
+    
+    Args:
+        data: 要序列化的对象
+        
+    Returns:
+        bytes: JSON字节
+    """
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False).encode("utf-8")
+
+
 def parse_prompt_parameters(prompt: str, default_ratio: str = "1:1") -> Tuple[str, int, str]:
     """
     从prompt中解析参数